@@ -2,10 +2,53 @@ import cv2
 import math
 import time
 import numpy as np
-from threading import Lock, Thread
+from threading import Event, Lock, Thread
+
+try:
+    import renderer_jit
+except ImportError:
+    # numba is not installed, render with numpy
+    renderer_jit = None
+
+
+# vertices closer than this to the camera plane are not projected
+NEAR = 0.03
+
+
+def _project_numpy(verts, MT, offset, out, valid, scratch):
+    '''
+    Project world vertices to pixel coordinate
+        verts: (N, 3) float32 world vertices
+        MT, offset: projection matrix P split as P·[v, 1] = v·MT + offset,
+            pixel coordinate is P[:2]·v / P[2]·v
+        out: (N, 2) int32 pixel coordinate output
+        valid: (N,) bool output, False for vertices behind the near plane
+        scratch: (N, 3) float32 work array
+    '''
+    w = scratch
+    np.matmul(verts, MT, out=w)
+    w += offset
+    np.greater_equal(w[:, 2], NEAR, out=valid)
+    np.maximum(w[:, 2:3], NEAR, out=w[:, 2:3])
+    np.divide(w[:, :2], w[:, 2:3], out=w[:, :2])
+    np.rint(w[:, :2], out=w[:, :2])
+    out[:] = w[:, :2]
+    out[~valid] = 0
+
+
+def pack_bgr(colors):
+    '''
+    Pack (N, 3) BGR colors into (N,) uint32 words laid out like the canvas pixels
+    '''
+    colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+    packed = np.zeros((len(colors), 4), dtype=np.uint8)
+    packed[:, :3] = colors
+    return packed.view(np.uint32).reshape(-1)
 
 
 class Object3D(object):
+    __slots__ = ('_scene', '_color')
+
     def __init__(self):
         self._scene = None
         self._color = (0x00, 0x00, 0x00)
@@ -30,60 +73,101 @@ class Point(Object3D):
     '''
     3D space point
     '''
+    __slots__ = ('_xyz', '_thickness')
 
     def __init__(self, x, y, z, color=(0xFF, 0xFF, 0xFF), thickness=1):
         super().__init__()
-        self._x, self._y, self._z = x, y, z
+        self._xyz = np.array([x, y, z], dtype=np.float32)
         self._color = color
         self._thickness = thickness
 
     def refresh(self, camera):
-        v_c = camera.trans_to_cam(np.array([[self._x, self._y, self._z]]))
-        proj_v = camera.project(v_c)
-        camera.draw_point_2d(round(proj_v[0][0]), round(proj_v[0][1]), self._color, self._thickness)
+        pixel = np.empty((1, 2), dtype=np.int32)
+        valid = np.empty(1, dtype=np.bool_)
+        camera.project_pixels(self._xyz.reshape(1, 3), pixel, valid)
+        if valid[0]:
+            camera.draw_point_2d(pixel[0, 0], pixel[0, 1], self._color, self._thickness)
+
 
 class Vertices(Object3D):
     '''
     3D space vertices
     '''
+    __slots__ = ('_verts', '_texture')
 
     def __init__(self, v, color=(0xFF, 0xFF, 0xFF), texture=None):
         super().__init__()
-        self._verts = v
+        self._verts = np.ascontiguousarray(v, dtype=np.float32).reshape(-1, 3)
         self._color = color
-        self._texture = texture
+        # per vertex BGR color, packed to match the canvas pixel words
+        self._texture = None if texture is None else pack_bgr(texture)
 
     def refresh(self, camera):
-        v_c = camera.trans_to_cam(self._verts)
-        proj_v = camera.project(v_c)
-        camera.render(proj_v, self._color, texture=self._texture)
+        camera.scatter_world(self._verts, self._color, texture=self._texture)
 
 
 class Line(Object3D):
     '''
     3D space line
     '''
+    __slots__ = ('_start', '_end', '_thickness', '_line_type')
 
-    def __init__(self, start, end, color=(0xFF, 0xFF, 0xFF), thickness=1):
+    def __init__(self, start, end, color=(0xFF, 0xFF, 0xFF), thickness=1, line_type=cv2.LINE_8):
         super().__init__()
-        self._start, self._end = np.array(start), np.array(end)
+        self._start = np.asarray(start, dtype=np.float32).reshape(3)
+        self._end = np.asarray(end, dtype=np.float32).reshape(3)
         self._color = color
         self._thickness = thickness
+        self._line_type = line_type
 
     def refresh(self, camera):
-        start_c = camera.trans_to_cam(np.array([self._start]))
-        start_p = camera.project(start_c)
-        end_c = camera.trans_to_cam(np.array([self._end]))
-        end_p = camera.project(end_c)
-        if np.isnan(start_p[0]).any() or np.isinf(start_p[0]).any() or \
-                np.isnan(end_p[0]).any() or np.isinf(end_p[0]).any():
+        ends = np.stack([self._start, self._end])
+        pixels = np.empty((2, 2), dtype=np.int32)
+        valid = np.empty(2, dtype=np.bool_)
+        camera.project_pixels(ends, pixels, valid)
+        if valid.all():
+            start, end = pixels.tolist()
+        elif valid.any():
+            # the line crosses the near plane, cut it at the plane
+            (start, end), = camera.project_crossing(ends[:1], ends[1:]).tolist()
+        else:
             return
-        camera.draw_line_2d(tuple(start_p[0].astype(int)),
-                            tuple(end_p[0].astype(int)),
-                            self._color, self._thickness)
+        camera.draw_line_2d(tuple(start), tuple(end), self._color, self._thickness, self._line_type)
+
+
+class Lines(Object3D):
+    '''
+    A batch of 3D space lines sharing the same style
+    '''
+    __slots__ = ('_endpoints', '_thickness', '_line_type')
+
+    def __init__(self, starts, ends, color=(0xFF, 0xFF, 0xFF), thickness=1, line_type=cv2.LINE_8):
+        super().__init__()
+        # (M, 2, 3) [start, end] of each line
+        self._endpoints = np.stack([np.asarray(starts, dtype=np.float32).reshape(-1, 3),
+                                    np.asarray(ends, dtype=np.float32).reshape(-1, 3)], axis=1)
+        self._color = color
+        self._thickness = thickness
+        self._line_type = line_type
+
+    def refresh(self, camera):
+        ends = self._endpoints.reshape(-1, 3)
+        pixels = np.empty((len(ends), 2), dtype=np.int32)
+        valid = np.empty(len(ends), dtype=np.bool_)
+        camera.project_pixels(ends, pixels, valid)
+        pairs = valid.reshape(-1, 2)
+        segments = pixels.reshape(-1, 2, 2)[pairs[:, 0] & pairs[:, 1]]
+        crossing = pairs[:, 0] != pairs[:, 1]
+        if crossing.any():
+            cut = self._endpoints[crossing]
+            segments = np.concatenate([segments, camera.project_crossing(cut[:, 0], cut[:, 1])])
+        if len(segments) > 0:
+            camera.draw_lines_2d(segments, self._color, self._thickness, self._line_type)
 
 
 class Box(Object3D):
+    __slots__ = ('_center', '_size')
+
     def __init__(self, center, size, color=(0xFF, 0xFF, 0xFF)):
         super().__init__()
         self._center = center
@@ -109,24 +193,36 @@ class Canvas(object):
 class Camera(Thread):
     def __init__(self, width, height, fps=30):
         Thread.__init__(self)
+        # set when the scene or camera changed, the render thread waits on it
+        self._wake = Event()
         # camera position in world frame
         self._x, self._y, self._z = 0, 0, 0
-        self._pos = np.array([self._x, self._y, self._z])
+        self._pos = np.array([self._x, self._y, self._z], dtype=np.float32)
         self._fps = fps
 
         self._scene = None
 
         # camera rotation
         self._roll, self._pitch, self._yaw = 0, 0, 0
-        self.R = np.array([[1, 0, 0],
-                           [0, 1, 0],
-                           [0, 0, 1]])
+        self.R = np.eye(3, dtype=np.float32)
 
         self._canvas_width, self._canvas_height = width,height
-        self._canvas_shown = np.zeros((height, width, 3))
-        self._canvas_hidden = np.zeros((height, width, 3))
-        self._canvas_lock = Lock()
+        # double buffered canvas, the hidden one is drawn while the other is shown
+        # each pixel is BGR plus a padding byte, so a pixel is one aligned 32 bit word
+        # and vertex scatters write through a uint32 view with a single store
+        self._buffers = [np.zeros((height, width, 4), dtype=np.uint8),
+                         np.zeros((height, width, 4), dtype=np.uint8)]
+        self._buffers32 = [b.view(np.uint32).reshape(height, width) for b in self._buffers]
+        self._hidden_idx = 0
         self._canvas_swap_lock = Lock()
+        # BGR copy of the shown canvas owned by play(), imshow gets it without the padding byte
+        self._display = np.zeros((height, width, 3), dtype=np.uint8)
+
+        # work array of the projection, grown on demand
+        self._scratch = np.empty((64, 3), dtype=np.float32)
+        # single color packed for the scatter, _color_packed is its uint32 view
+        self._color_scratch = np.zeros((1, 4), dtype=np.uint8)
+        self._color_packed = self._color_scratch.view(np.uint32).reshape(1)
 
         # camera focus length in meter
         self._f = 1
@@ -137,30 +233,47 @@ class Camera(Thread):
         #   but normally we output [u, v, 1], then self.intrinsic[3][3] is 1
         self.intrinsic = np.array([[self._f*self._s,    0,                  self._canvas_width/2.0],
                                    [0,                  self._f*self._s,    self._canvas_height/2.0],
-                                   [0,                  0,                  1]])
+                                   [0,                  0,                  1]], dtype=np.float32, order='C')
+        # image plane to canvas: u = width - u, v = height - v
+        self._flip = np.array([[-1,     0,      self._canvas_width],
+                               [0,      -1,     self._canvas_height],
+                               [0,      0,      1]], dtype=np.float32)
+        self._update_projection()
+
+        # use the numba kernels of renderer_jit for projection and scatter
+        self.jit = renderer_jit is not None
 
         self._running = True
 
     def set_scene(self, scene):
         self._scene = scene
+        self.wake()
+
+    def wake(self):
+        '''
+        Wake the render thread to render a new frame
+        '''
+        self._wake.set()
 
     def stop(self):
         self._running = False
+        self.wake()
         self.join()
 
     def run(self):
         while self._running:
+            # render on change, or at most once per frame period
+            self._wake.wait(timeout=1.0/self._fps)
+            self._wake.clear()
             if not self._scene:
-                time.sleep(0.1)
                 continue
 
-            objects = self._scene.get_objects()
-            if len(objects) == 0:
+            frame = self._scene.get_frame()
+            if frame.empty():
                 continue
 
             self.clean_canvas()
-            for obj in objects:
-                self.view(obj)
+            frame.refresh(self)
             self.flush_canvas()
 
     def view(self, obj):
@@ -169,6 +282,18 @@ class Camera(Thread):
         '''
         obj.refresh(self)
 
+    @property
+    def _canvas_hidden(self):
+        return self._buffers[self._hidden_idx]
+
+    @property
+    def _canvas_shown(self):
+        return self._buffers[1 - self._hidden_idx]
+
+    @property
+    def _canvas_hidden32(self):
+        return self._buffers32[self._hidden_idx]
+
     @property
     def roll(self):
         return self._roll
@@ -203,8 +328,9 @@ class Camera(Thread):
     @focus.setter
     def focus(self, value):
         self._f = value
-        self.intrinsic[0][0] = self._f * self._s
-        self.intrinsic[1][1] = self._f * self._s
+        self.intrinsic[0, 0] = self._f * self._s
+        self.intrinsic[1, 1] = self._f * self._s
+        self._update_projection()
 
     @property
     def scale(self):
@@ -213,83 +339,199 @@ class Camera(Thread):
     @scale.setter
     def scale(self, value):
         self._s = value
-        self.intrinsic[0][0] = self._f * self._s
-        self.intrinsic[1][1] = self._f * self._s
+        self.intrinsic[0, 0] = self._f * self._s
+        self.intrinsic[1, 1] = self._f * self._s
+        self._update_projection()
 
     def move(self, x, y, z):
         '''
         Move camera to new position
         '''
         self._x, self._y, self._z = float(x), float(y), float(z)
+        self._pos = np.array([self._x, self._y, self._z], dtype=np.float32)
+        self._update_projection()
 
     def rotate(self, roll, pitch, yaw):
         '''
         Rotate camera by roll, pitch, yaw, then world coordinate rotate by -roll, -pitch, -yaw
         '''
-        rx, _ = cv2.Rodrigues((-pitch, 0, 0))
-        ry, _ = cv2.Rodrigues((0, -yaw, 0))
-        rz, _ = cv2.Rodrigues((0, 0, -roll))
-        self.R = np.dot(rz, np.dot(ry, rx))
-
-    def trans_to_cam(self, v):
+        cr, sr = math.cos(roll), math.sin(roll)
+        cp, sp = math.cos(pitch), math.sin(pitch)
+        cy, sy = math.cos(yaw), math.sin(yaw)
+        # R = Rz(-roll)·Ry(-yaw)·Rx(-pitch) expanded
+        self.R = np.array([[cr*cy,      cr*sy*sp + sr*cp,       sr*sp - cr*sy*cp],
+                           [-sr*cy,     cr*cp - sr*sy*sp,       cr*sp + sr*sy*cp],
+                           [sy,         -cy*sp,                 cy*cp]], dtype=np.float32)
+        self._update_projection()
+
+    def _update_projection(self):
         '''
-        Transform the world coordinate vertices to camera coordinate vertices
-            v: vertices in world coordinate frame
+        Rebuild the 3x4 projection matrix P = F·K·[R|-R·t], must be called whenever
+        rotation, position or intrinsic changes
+            F flips the image plane to canvas coordinate, u = width - u'/w = (width*w - u')/w,
+            so that the projection is a bare perspective divide
         '''
-        #vc = np.dot(self.R, v.T) - np.array([[self._x], [self._y], [self._z]])
-        vc = np.dot(self.R, (v.T - np.array([[self._x], [self._y], [self._z]])))
-        return vc.T
-
-    def project(self, v):
+        P = np.dot(self._flip, np.dot(self.intrinsic, np.hstack([self.R, -np.dot(self.R, self._pos)[:, None]])))
+        # P split for the row-major batch form P·[v, 1] = v·M^T + offset
+        MT = np.ascontiguousarray(P[:, :3].T)
+        offset = P[:, 3].copy()
+        # published as one tuple so the render thread never mixes two updates,
+        # and woken only once the new matrix is in place
+        self._projection = (P, MT, offset)
+        self._info_dirty = True
+        self.wake()
+
+    def project_pixels(self, v, out, valid):
+        '''
+        Project the vertices of world coordinate to integer pixel coordinate
+            v: (N, 3) float32 vertices in world coordinate frame
+            out: (N, 2) int32 array receiving the pixel coordinate
+            valid: (N,) bool array, set False for vertices behind the near plane
+        '''
+        assert v.dtype == np.float32
+        P, MT, offset = self._projection
+        if self.jit:
+            renderer_jit.project(v, P, out, valid, NEAR)
+        else:
+            _project_numpy(v, MT, offset, out, valid, self._get_scratch(len(v)))
+
+    def project_crossing(self, starts, ends):
+        '''
+        Project segments which cross the near plane, the end point behind the plane
+        is moved onto it
+            starts, ends: (K, 3) float32 end points in world coordinate frame
+        return (K, 2, 2) int32 array of [start, end] pixel coordinate
+        '''
+        # the homogeneous projection is linear, so the cut point is interpolated
+        # directly in projected space where w is the depth
+        _, MT, offset = self._projection
+        ha = np.matmul(starts, MT) + offset
+        hb = np.matmul(ends, MT) + offset
+        t = (NEAR - ha[:, 2:3]) / (hb[:, 2:3] - ha[:, 2:3])
+        hc = ha + t * (hb - ha)
+        np.copyto(ha, hc, where=ha[:, 2:3] < NEAR)
+        np.copyto(hb, hc, where=hb[:, 2:3] < NEAR)
+        ha[:, :2] /= ha[:, 2:3]
+        hb[:, :2] /= hb[:, 2:3]
+        segments = np.empty((len(ha), 2, 2), dtype=np.int32)
+        segments[:, 0] = np.rint(ha[:, :2], out=ha[:, :2])
+        segments[:, 1] = np.rint(hb[:, :2], out=hb[:, :2])
+        return segments
+
+    def _get_scratch(self, n):
         '''
-        Project the vertices of camera coordinate to camera image plane coordinate
-            v: vertices in camera coordinate frame
-                u = width - f*(Y/X)
-                v = height - f*(Z/X)
+        Get a (n, 3) float32 work array, the storage grows by power of two and is reused
         '''
-        Z = np.expand_dims(v[:, -1], axis=1)
-        with np.errstate(divide='ignore', invalid='ignore'):
-            proj_v = np.transpose(np.dot(self.intrinsic, v.T)) / Z
-        proj_v[v[:, 2]< 0.03] = np.nan
-        proj_v[:, 0:2] = [self._canvas_width, self._canvas_height] - proj_v[:, 0:2]
-        return proj_v[:, 0:2]
+        if n > len(self._scratch):
+            self._scratch = np.empty((1 << (n-1).bit_length(), 3), dtype=np.float32)
+        return self._scratch[:n]
 
     def draw_point_2d(self, x, y, color=(0xFF, 0xFF, 0xFF), thickness=1):
         '''
         Draw a point on the canvas
         '''
-        with self._canvas_lock:
-            cv2.circle(self._canvas_hidden, (int(x), int(y)), math.ceil(thickness/2.0), color)
+        cv2.circle(self._canvas_hidden, (int(x), int(y)), math.ceil(thickness/2.0), color)
 
-    def draw_line_2d(self, start, end, color, thickness=1):
+    def draw_line_2d(self, start, end, color, thickness=1, line_type=cv2.LINE_8):
         '''
         Draw a line on the canvas
+            line_type: cv2.LINE_8 is much cheaper to rasterize than cv2.LINE_AA
         '''
-        with self._canvas_lock:
-            rect = (0, 0, self._canvas_width, self._canvas_height)
-            inside, sp, ep = cv2.clipLine(rect, start, end)
-            if inside:
-                cv2.line(self._canvas_hidden, sp, ep, color, thickness, cv2.LINE_AA)
-
-    def render(self, v, color, texture=None):
-        with self._canvas_lock:
-            selector = v.astype(int)
-            x, y = selector[:, 0:2].T
-            xy_filter = (((y > 0) & (y < self._canvas_height)) & \
-                         ((x > 0) & (x < self._canvas_width)))
-            if texture is not None:
-                self._canvas_hidden[y[xy_filter], x[xy_filter]] = texture[xy_filter]
-            else:
-                self._canvas_hidden[y[xy_filter], x[xy_filter]] = color
+        rect = (0, 0, self._canvas_width, self._canvas_height)
+        inside, sp, ep = cv2.clipLine(rect, start, end)
+        if inside:
+            cv2.line(self._canvas_hidden, sp, ep, color, thickness, line_type)
+
+    def draw_lines_2d(self, segments, color, thickness=1, line_type=cv2.LINE_8):
+        '''
+        Draw line segments on the canvas in one call
+            segments: (M, 2, 2) int32 array of [start, end] pixel coordinate
+        '''
+        # the (M, 2, 2) array is taken as M polylines without building a list of views
+        cv2.polylines(self._canvas_hidden, segments, False, color, thickness, line_type)
+
+    def _pack_color(self, color, texture):
+        '''
+        Packed colors for the scatter, the texture or color packed into a reused word
+        '''
+        if texture is not None:
+            return texture
+        self._color_scratch[0, :3] = color
+        return self._color_packed
+
+    def scatter_world(self, v, color, texture=None):
+        '''
+        Project world vertices and draw them on the canvas, vertices outside the
+        view frustum are culled before the perspective divide
+            v: (N, 3) float32 vertices in world coordinate frame
+            texture: (N,) per vertex color packed by pack_bgr, or None to draw all with color
+        '''
+        colors = self._pack_color(color, texture)
+        P, MT, offset = self._projection
+        if self.jit:
+            renderer_jit.project_and_scatter(v, P, NEAR, colors, self._canvas_hidden32)
+            return
+
+        h = np.matmul(v, MT) + offset
+        w = h[:, 2]
+        # pixels are rounded like project_pixels, u = rint(u'/w) is on the canvas
+        # iff -0.5*w <= u' < (width - 0.5)*w, so no divide is needed to cull
+        visible = (w >= NEAR) & \
+                  (h[:, 0] >= -0.5 * w) & (h[:, 0] < (self._canvas_width - 0.5) * w) & \
+                  (h[:, 1] >= -0.5 * w) & (h[:, 1] < (self._canvas_height - 0.5) * w)
+        h = h[visible]
+        # the clip only guards the divide rounding across the canvas border
+        x = np.clip(np.rint(h[:, 0] / h[:, 2]), 0, self._canvas_width - 1).astype(np.intp)
+        y = np.clip(np.rint(h[:, 1] / h[:, 2]), 0, self._canvas_height - 1).astype(np.intp)
+        self._canvas_hidden32.reshape(-1)[y * self._canvas_width + x] = colors if texture is None else colors[visible]
+
+    def in_canvas(self, pixels, margin=0):
+        '''
+        Mask of the pixel coordinates within margin of the canvas
+            pixels: (N, 2) int pixel coordinate
+            margin: scalar or (N,) int
+        '''
+        x, y = pixels[:, 0], pixels[:, 1]
+        return (x >= -margin) & (x < self._canvas_width + margin) & \
+               (y >= -margin) & (y < self._canvas_height + margin)
 
     def clean_canvas(self):
-        with self._canvas_lock:
-            self._canvas_hidden = np.zeros((self._canvas_height, self._canvas_width, 3))
+        self._canvas_hidden.fill(0)
 
     def flush_canvas(self):
-        with self._canvas_lock:
-            self._canvas_shown = self._canvas_hidden
-            self._canvas_hidden = None
+        '''
+        Swap the hidden and shown canvas
+            Only the render thread draws on the hidden canvas and only play()
+            copies the shown one, so the lock just guards the swap against that copy
+        '''
+        with self._canvas_swap_lock:
+            self._hidden_idx = 1 - self._hidden_idx
+
+    def _render_info(self):
+        '''
+        Render the camera info overlay into a tile, it is pasted onto the shown
+        canvas every frame and only re-rendered when the camera state changes
+        '''
+        tile = np.zeros((64, 200, 3), dtype=np.uint8)
+        texts = ['Camera',
+                 '  Position: x: %.1f, y: %.1f, z: %.1f' % (self._x, self._y, self._z),
+                 '  Rotation: R: %.2f, P: %.2f, Y: %.2f' % (self._roll, self._pitch, self._yaw),
+                 '  Focus: %.2f' % (self.focus),
+                 '  Scale: %d' % (self.scale)]
+        h_offset = 20
+        font_size = 0.3
+        font_thickness = 1
+        for text in texts:
+            cv2.putText(tile, text, (0, h_offset),
+                        cv2.FONT_HERSHEY_SIMPLEX, font_size,
+                        (0xA0, 0xA0, 0xA0), font_thickness, cv2.LINE_AA)
+            h_offset += 10
+        # crop to the canvas, the tile sits in its top-right corner
+        h, w = min(tile.shape[0], self._canvas_height), min(tile.shape[1], self._canvas_width)
+        self._info_tile = tile[:h, :w]
+        self._info_mask = self._info_tile.any(axis=2, keepdims=True)
+        self._info_roi = (slice(0, h), slice(self._canvas_width-w, self._canvas_width))
+        self._info_dirty = False
 
     def play(self, name, show_fps=True):
         '''
@@ -297,54 +539,30 @@ class Camera(Thread):
         '''
         cv2.namedWindow(name)
         fps = self._fps
+        title_fps = None
         info_toggle = True
+        if not show_fps:
+            cv2.setWindowTitle(name, name)
         while True:
-            frame_start = time.time()
-            with self._canvas_lock:
-                if info_toggle:
-                    w_offset = 200
-                    h_offset = 20
-                    font_size = 0.3
-                    font_thickness = 1
-                    cv2.putText(self._canvas_shown,
-                                'Camera',
-                                (self._canvas_width-w_offset, h_offset),
-                                cv2.FONT_HERSHEY_SIMPLEX, font_size,
-                                (0xA0, 0xA0, 0xA0), font_thickness, cv2.LINE_AA)
-                    h_offset += 10
-                    cv2.putText(self._canvas_shown,
-                                '  Position: x: %.1f, y: %.1f, z: %.1f' % (self._x, self._y, self._z),
-                                (self._canvas_width-w_offset, h_offset),
-                                cv2.FONT_HERSHEY_SIMPLEX, font_size,
-                                (0xA0, 0xA0, 0xA0), font_thickness, cv2.LINE_AA)
-                    h_offset += 10
-                    cv2.putText(self._canvas_shown,
-                                '  Rotation: R: %.2f, P: %.2f, Y: %.2f' % (self._roll, self._pitch, self._yaw),
-                                (self._canvas_width-w_offset, h_offset),
-                                cv2.FONT_HERSHEY_SIMPLEX, font_size,
-                                (0xA0, 0xA0, 0xA0), font_thickness, cv2.LINE_AA)
-                    h_offset += 10
-                    cv2.putText(self._canvas_shown,
-                                '  Focus: %.2f' % (self.focus),
-                                (self._canvas_width-w_offset, h_offset),
-                                cv2.FONT_HERSHEY_SIMPLEX, font_size,
-                                (0xA0, 0xA0, 0xA0), font_thickness, cv2.LINE_AA)
-                    h_offset += 10
-                    cv2.putText(self._canvas_shown,
-                                '  Scale: %d' % (self.scale),
-                                (self._canvas_width-w_offset, h_offset),
-                                cv2.FONT_HERSHEY_SIMPLEX, font_size,
-                                (0xA0, 0xA0, 0xA0), font_thickness, cv2.LINE_AA)
-                cv2.imshow(name, self._canvas_shown)
-
-            if show_fps:
-                win_name = '%s Size(%d,%d) %d fps' % (name, self._canvas_width, self._canvas_height, round(fps))
-            else:
-                win_name = name
-
-            cv2.setWindowTitle(name, win_name)
-
-            key = cv2.waitKey(1) & 0xFF
+            frame_start = time.perf_counter()
+            if info_toggle and self._info_dirty:
+                self._render_info()
+            # only the copy of the shown canvas has to wait for the swap, the
+            # overlay and imshow then run while the next frame is rendered
+            with self._canvas_swap_lock:
+                np.copyto(self._display, self._canvas_shown[:, :, :3])
+            if info_toggle:
+                np.copyto(self._display[self._info_roi], self._info_tile, where=self._info_mask)
+            cv2.imshow(name, self._display)
+
+            if show_fps and round(fps) != title_fps:
+                title_fps = round(fps)
+                cv2.setWindowTitle(name, '%s Size(%d,%d) %d fps' % (name, self._canvas_width, self._canvas_height, title_fps))
+
+            # wait out the rest of the frame budget while polling the keyboard
+            time_render = time.perf_counter() - frame_start
+            budget_ms = max(1, int((1.0/self._fps - time_render) * 1000))
+            key = cv2.waitKey(budget_ms) & 0xFF
             # ESC
             if key == 0x1b:
                 break
@@ -380,39 +598,157 @@ class Camera(Thread):
             elif key == ord('['):
                 self.scale -= 10
             elif key == ord('q'):
-                self._z -= 0.1
+                self.move(self._x, self._y, self._z - 0.1)
             elif key == ord('e'):
-                self._z += 0.1
+                self.move(self._x, self._y, self._z + 0.1)
             elif key == ord('w'):
-                self._y += 0.1
+                self.move(self._x, self._y + 0.1, self._z)
             elif key == ord('s'):
-                self._y -= 0.1
+                self.move(self._x, self._y - 0.1, self._z)
             elif key == ord('a'):
-                self._x += 0.1
+                self.move(self._x + 0.1, self._y, self._z)
             elif key == ord('d'):
-                self._x -= 0.1
+                self.move(self._x - 0.1, self._y, self._z)
             # info
             elif key == ord('i'):
                 info_toggle = not info_toggle
 
-            time_render = time.time() - frame_start
-            frame_sleep = max(1.0/self._fps - time_render, 0)
-            time.sleep(frame_sleep)
-            fps = 1.0/(time.time() - frame_start)
+            fps = 1.0/(time.perf_counter() - frame_start)
 
 
 class Frame(object):
-    def __init__(self):
+    '''
+    A frame of objects, points and lines are packed into a single vertex array
+    so they are projected in one batch, vertex clouds are culled to the view
+    frustum by the camera before their perspective divide
+        Objects are drawn by kind rather than in insertion order: vertex clouds
+        first, then lines grouped by style, then points on top
+    '''
+
+    def __init__(self, capacity=64):
         self._objects = []
         self._obj_lock = Lock()
 
+        # vertices of all points/lines, drawables refer to them by index
+        self._verts = np.empty((capacity, 3), dtype=np.float32)
+        self._n_verts = 0
+        # projection output of the vertices, reused every refresh
+        self._pixels = np.empty((capacity, 2), dtype=np.int32)
+        self._valid = np.empty(capacity, dtype=np.bool_)
+
+        # points as columns: vertex index, color and thickness
+        self._pt_index = []
+        self._pt_color = []
+        self._pt_thickness = []
+        # column arrays of the points, built on first refresh
+        self._pt_arrays = None
+        # lines grouped by style so each group is drawn in one call:
+        #   {(color, thickness, line type): [(start index, end index) or (M, 2) index array]}
+        self._line_groups = {}
+        # index arrays of _line_groups, built on first refresh
+        self._line_indices = None
+
+        # Vertices objects, each drawn by a single scatter_world
+        self._clouds = []
+
+        # objects which are refreshed by themselves
+        self._others = []
+
+    def _alloc_verts(self, n):
+        '''
+        Reserve n vertices, return the index of the first one
+        '''
+        start = self._n_verts
+        if start + n > len(self._verts):
+            capacity = max(2 * len(self._verts), start + n)
+            verts = np.empty((capacity, 3), dtype=np.float32)
+            verts[:start] = self._verts[:start]
+            self._verts = verts
+            self._pixels = np.empty((capacity, 2), dtype=np.int32)
+            self._valid = np.empty(capacity, dtype=np.bool_)
+        self._n_verts += n
+        return start
+
     def add(self, obj):
         with self._obj_lock:
-            self.add_object.append(obj)
+            self._objects.append(obj)
+            if isinstance(obj, Point):
+                i = self._alloc_verts(1)
+                self._verts[i] = obj._xyz
+                self._pt_index.append(i)
+                self._pt_color.append(obj._color)
+                self._pt_thickness.append(obj._thickness)
+                self._pt_arrays = None
+            elif isinstance(obj, Line):
+                i = self._alloc_verts(2)
+                self._verts[i:i+2] = (obj._start, obj._end)
+                style = (tuple(obj._color), obj._thickness, obj._line_type)
+                self._line_groups.setdefault(style, []).append((i, i+1))
+                self._line_indices = None
+            elif isinstance(obj, Lines):
+                m = len(obj._endpoints)
+                i = self._alloc_verts(2*m)
+                self._verts[i:i+2*m] = obj._endpoints.reshape(-1, 3)
+                pairs = i + np.arange(2*m).reshape(m, 2)
+                style = (tuple(obj._color), obj._thickness, obj._line_type)
+                self._line_groups.setdefault(style, []).append(pairs)
+                self._line_indices = None
+            elif isinstance(obj, Vertices):
+                self._clouds.append(obj)
+            else:
+                self._others.append(obj)
 
-    def clear(self):
+    def empty(self):
+        return len(self._objects) == 0
+
+    def unbind(self):
         with self._obj_lock:
-            self._objects = []
+            for obj in self._objects:
+                obj.unbind()
+
+    def refresh(self, camera):
+        '''
+        Refresh the frame in the view of camera
+        '''
+        for cloud in self._clouds:
+            camera.view(cloud)
+
+        n = self._n_verts
+        if n > 0:
+            pixels, valid = self._pixels[:n], self._valid[:n]
+            camera.project_pixels(self._verts[:n], pixels, valid)
+
+            if self._line_indices is None:
+                self._line_indices = [(style, np.vstack(pairs).astype(np.intp))
+                                      for style, pairs in self._line_groups.items()]
+            for (color, thickness, line_type), pairs in self._line_indices:
+                ok = valid[pairs]
+                segments = pixels[pairs][ok[:, 0] & ok[:, 1]]
+                # lines crossing the near plane are cut at the plane instead of dropped
+                crossing = ok[:, 0] != ok[:, 1]
+                if crossing.any():
+                    cut = pairs[crossing]
+                    segments = np.concatenate([segments,
+                                               camera.project_crossing(self._verts[cut[:, 0]],
+                                                                       self._verts[cut[:, 1]])])
+                if len(segments) > 0:
+                    camera.draw_lines_2d(segments, color, thickness, line_type)
+
+            if self._pt_index:
+                if self._pt_arrays is None:
+                    self._pt_arrays = (np.array(self._pt_index, dtype=np.intp),
+                                       np.array(self._pt_color, dtype=np.uint8).reshape(-1, 3),
+                                       np.array(self._pt_thickness, dtype=np.int32))
+                index, colors, thickness = self._pt_arrays
+                # cull in batch, only the points drawn are converted to python values
+                uv = pixels[index]
+                shown = np.flatnonzero(valid[index] & camera.in_canvas(uv, (thickness+1)//2))
+                for (x, y), color, t in zip(uv[shown].tolist(), colors[shown].tolist(),
+                                            thickness[shown].tolist()):
+                    camera.draw_point_2d(x, y, color, t)
+
+        for obj in self._others:
+            camera.view(obj)
 
 
 class Scene(object):
@@ -421,15 +757,18 @@ class Scene(object):
         self._name = name
         self._cam = None
         self._obj_lock = Lock()
-        self._objects = []
-        self._active_objects = []
-        self._drawing_objects = []
+        self._active_frame = Frame()
+        self._drawing_frame = Frame()
         #self._running = True
         self._need_flush = False
 
-    def get_objects(self):
-        with self._obj_lock:
-            return self._active_objects
+    def get_frame(self):
+        '''
+        Get the active frame
+            A flushed frame is never added to again and is replaced as a whole,
+            reading the reference is atomic so the camera thread takes no lock
+        '''
+        return self._active_frame
 
     #def _refresh(self):
     #    '''
@@ -476,46 +815,55 @@ class Scene(object):
         pt = Point(x, y, z, color, thickness)
         pt.bind(self)
         with self._obj_lock:
-            self._drawing_objects.append(pt)
+            self._drawing_frame.add(pt)
 
-    def draw_line_3d(self, start, end, color=(0xFF, 0xFF, 0xFF), thickness=1):
+    def draw_line_3d(self, start, end, color=(0xFF, 0xFF, 0xFF), thickness=1, line_type=cv2.LINE_8):
         '''
         Draw a line on the canvas
             start: start position (tuple)
             end: end position (tuple)
         '''
-        line = Line(start, end, color, thickness)
+        line = Line(start, end, color, thickness, line_type)
         line.bind(self)
         with self._obj_lock:
-            self._drawing_objects.append(line)
+            self._drawing_frame.add(line)
+
+    def draw_lines_3d_batch(self, starts, ends, color=(0xFF, 0xFF, 0xFF), thickness=1, line_type=cv2.LINE_8):
+        '''
+        Draw a batch of lines with the same style on the canvas
+            starts: (M, 3) start positions
+            ends: (M, 3) end positions
+        '''
+        lines = Lines(starts, ends, color, thickness, line_type)
+        lines.bind(self)
+        with self._obj_lock:
+            self._drawing_frame.add(lines)
 
     def draw_vertices(self, verts, color=(0xFF, 0xFF, 0xFF), texture=None):
         verts = Vertices(verts, color, texture)
         verts.bind(self)
         with self._obj_lock:
-            self._drawing_objects.append(verts)
+            self._drawing_frame.add(verts)
 
     def clear(self):
         '''
         Clear the active frame
         '''
         with self._obj_lock:
-            for obj in self._active_objects:
-                obj.unbind()
-            self._active_objects = []
-            for obj in self._drawing_objects:
-                obj.unbind()
-            self._drawing_objects = []
+            self._active_frame.unbind()
+            self._active_frame = Frame()
+            self._drawing_frame.unbind()
+            self._drawing_frame = Frame()
 
     def flush(self):
         '''
         Flush the drawing frame to the active frame
         '''
         with self._obj_lock:
-            for obj in self._active_objects:
-                obj.unbind()
-            self._active_objects = self._drawing_objects
-            self._drawing_objects = []
+            self._active_frame.unbind()
+            self._active_frame, self._drawing_frame = self._drawing_frame, Frame()
+        if self._cam:
+            self._cam.wake()
 
 
 def test():
@@ -525,24 +873,18 @@ def test():
     scene.set_camera(cam, 0, 0, -10)
 
     # add origin axis marker
-    scene.draw_line_3d((0, 0, 0), (1, 0, 0), color=(0x00, 0x00, 0xFF), thickness=1)
-    scene.draw_line_3d((0, 0, 0), (0, 1, 0), color=(0x00, 0xFF, 0x00), thickness=1)
-    scene.draw_line_3d((0, 0, 0), (0, 0, 1), color=(0xFF, 0x00, 0x00), thickness=1)
+    scene.draw_line_3d((0, 0, 0), (1, 0, 0), color=(0x00, 0x00, 0xFF), thickness=1, line_type=cv2.LINE_AA)
+    scene.draw_line_3d((0, 0, 0), (0, 1, 0), color=(0x00, 0xFF, 0x00), thickness=1, line_type=cv2.LINE_AA)
+    scene.draw_line_3d((0, 0, 0), (0, 0, 1), color=(0xFF, 0x00, 0x00), thickness=1, line_type=cv2.LINE_AA)
 
     # add a grid
     length = 10
     grid = 10
-    grid_x = -length/2.0
-    grid_z = -length/2.0
-    for i in range(0, grid+1):
-        scene.draw_line_3d((grid_x, -1, grid_z), (grid_x, -1, grid_z+length), color=(0xA0, 0xA0, 0xA0), thickness=1)
-        grid_x += 1.0*length/grid
-
-    grid_x = -length/2.0
-    grid_z = -length/2.0
-    for i in range(0, grid+1):
-        scene.draw_line_3d((grid_x, -1, grid_z), (grid_x+length, -1, grid_z), color=(0xA0, 0xA0, 0xA0), thickness=1)
-        grid_z += 1.0*length/grid
+    ticks = np.linspace(-length/2.0, length/2.0, grid+1)
+    starts = np.stack([ticks, np.full_like(ticks, -1), np.full_like(ticks, -length/2.0)], axis=1)
+    scene.draw_lines_3d_batch(starts, starts + (0, 0, length), color=(0xA0, 0xA0, 0xA0), thickness=1)
+    starts = np.stack([np.full_like(ticks, -length/2.0), np.full_like(ticks, -1), ticks], axis=1)
+    scene.draw_lines_3d_batch(starts, starts + (length, 0, 0), color=(0xA0, 0xA0, 0xA0), thickness=1)
 
     # add a point
     scene.draw_point_3d(0.1, -0.1, 1, color=(0x00, 0xFF, 0x00))
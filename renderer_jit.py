@@ -0,0 +1,59 @@
+'''
+Numba compiled rendering kernels, used by the camera when numba is installed
+'''
+from numba import njit
+
+
+@njit(fastmath=True, cache=True)
+def project(verts, P, out, valid, near):
+    '''
+    Project world vertices to pixel coordinate
+        verts: (N, 3) float32 world vertices
+        P: (3, 4) projection matrix, pixel coordinate is P[:2]·v / P[2]·v
+        out: (N, 2) int32 pixel coordinate output
+        valid: (N,) bool output, False for vertices behind the near plane
+    '''
+    for i in range(verts.shape[0]):
+        x, y, z = verts[i, 0], verts[i, 1], verts[i, 2]
+        w = P[2, 0]*x + P[2, 1]*y + P[2, 2]*z + P[2, 3]
+        if w < near:
+            valid[i] = False
+            out[i, 0] = 0
+            out[i, 1] = 0
+            continue
+        u = P[0, 0]*x + P[0, 1]*y + P[0, 2]*z + P[0, 3]
+        v = P[1, 0]*x + P[1, 1]*y + P[1, 2]*z + P[1, 3]
+        valid[i] = True
+        out[i, 0] = round(u/w)
+        out[i, 1] = round(v/w)
+
+
+@njit(fastmath=True, cache=True)
+def project_and_scatter(verts, P, near, colors, canvas):
+    '''
+    Project world vertices and write the visible ones onto the canvas in one pass,
+    vertices outside the view frustum are culled before the perspective divide
+        verts: (N, 3) float32 world vertices
+        P: (3, 4) projection matrix, pixel coordinate is P[:2]·v / P[2]·v
+        colors: (N,) packed uint32 per vertex color, or (1,) for a single color
+        canvas: (H, W) uint32 view of the canvas
+    '''
+    height, width = canvas.shape[0], canvas.shape[1]
+    single = colors.shape[0] == 1
+    for i in range(verts.shape[0]):
+        x, y, z = verts[i, 0], verts[i, 1], verts[i, 2]
+        w = P[2, 0]*x + P[2, 1]*y + P[2, 2]*z + P[2, 3]
+        if w < near:
+            continue
+        # pixels are rounded like project(), round(u/w) is on the canvas
+        # iff -0.5*w <= u < (width - 0.5)*w
+        u = P[0, 0]*x + P[0, 1]*y + P[0, 2]*z + P[0, 3]
+        if u < -0.5*w or u >= (width - 0.5)*w:
+            continue
+        v = P[1, 0]*x + P[1, 1]*y + P[1, 2]*z + P[1, 3]
+        if v < -0.5*w or v >= (height - 0.5)*w:
+            continue
+        px, py = round(u/w), round(v/w)
+        if px < 0 or px >= width or py < 0 or py >= height:
+            continue
+        canvas[py, px] = colors[0 if single else i]